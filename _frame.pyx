@@ -0,0 +1,41 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""Compiled Waveshare frame packer
+
+Optional speedup for transport.pack_frame; build it in place with
+
+    pip install cython && cythonize -i _frame.pyx
+
+transport.py keeps using its pure-Python version when this isn't built.
+The layout here must match transport.FRAME_TEMPLATE.
+"""
+
+
+def pack_frame(int can_id, const unsigned char[::1] data):
+    """Build a Waveshare serial frame"""
+    cdef Py_ssize_t dlc = data.shape[0]
+    cdef Py_ssize_t i
+    cdef unsigned int total = 1
+    cdef bytearray frame
+    cdef unsigned char[::1] out
+
+    if dlc > 8:
+        raise ValueError("CAN frames carry at most 8 data bytes")
+
+    frame = bytearray(20)
+    out = frame
+    out[0] = 0xAA
+    out[1] = 0x55
+    out[2] = 0x01
+    out[3] = (can_id >> 8) & 0xFF
+    out[4] = 0x01
+    out[5] = can_id & 0xFF
+    out[6] = 0x01
+    out[9] = <unsigned char>dlc
+    for i in range(dlc):
+        out[10 + i] = data[i]
+
+    # Checksum is (sum of bytes 0-18 + 1) & 0xFF
+    for i in range(19):
+        total += out[i]
+    out[19] = total & 0xFF
+    return frame
@@ -0,0 +1,35 @@
+"""Keyboard input for the terminal controller"""
+import os
+import sys
+import termios
+import tty
+
+
+class TerminalKeys:
+    """Unbuffered keystrokes from the controlling terminal
+
+    Puts the terminal in cbreak mode for the duration of a ``with`` block.
+    It has a fileno(), so it can be waited on with select() next to the
+    CAN transport.
+    """
+
+    def __init__(self, stream=sys.stdin):
+        self.fd = stream.fileno()
+        self._old_settings = None
+
+    def __enter__(self):
+        self._old_settings = termios.tcgetattr(self.fd)
+        tty.setcbreak(self.fd)
+        return self
+
+    def __exit__(self, *exc_info):
+        termios.tcsetattr(self.fd, termios.TCSADRAIN, self._old_settings)
+
+    def fileno(self):
+        return self.fd
+
+    def read(self):
+        """Return every keystroke waiting on the terminal"""
+        # Read the fd directly: a buffered stream can swallow queued keys
+        # that select() would then no longer report as readable
+        return os.read(self.fd, 64).decode(errors='ignore')
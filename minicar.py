@@ -1,9 +1,12 @@
-import can
+import argparse
+import logging
+import struct
 import time
 import sys
-import select
-import termios
-import tty
+import selectors
+
+from keyboard_input import TerminalKeys
+from transport import SerialCanTransport, SocketCanTransport
 
 CANID_MOTOR_CMD = 0x100
 CANID_RX_HEARTBEAT = 0x103
@@ -15,125 +18,187 @@ CMD_BACKWARD = 4
 CMD_TURN_LEFT = 1
 CMD_TURN_RIGHT = 2
 
-last_rx_heartbeat = 0
-last_tx_heartbeat = 0
+# Movement keys -> motor command
+KEYMAP = {
+    'w': CMD_FORWARD,
+    'a': CMD_TURN_LEFT,
+    's': CMD_BACKWARD,
+    'd': CMD_TURN_RIGHT,
+}
+SPEED_KEYS = frozenset('123456789')
+
+# Motor command payload: command, speed, 6 padding bytes
+MOTOR_CMD_FORMAT = struct.Struct('BB6x')
+HEARTBEAT_DATA = bytes(8)  # heartbeat payload is all zeros
+
+HEARTBEAT_INTERVAL = 1.0  # seconds between TX heartbeats
+HEARTBEAT_TIMEOUT = 5.0   # seconds without RX heartbeat before warning
+RX_BATCH_MAX = 64  # frames handled per wakeup, so a flood can't starve input
+DEBOUNCE_INTERVAL = 0.05  # seconds; key auto-repeat faster than this is dropped
+
+last_rx_heartbeat = 0  # time.monotonic() of last RX heartbeat, 0 = none yet
 current_speed = 50  # default speed (0-99 PWM)
+last_command = None
+last_command_time = 0
+
+log = logging.getLogger('minicar')
 
-def setup_can_bus():
-    """Initialize CAN bus connection"""
+def setup_transport(args):
+    """Open the CAN transport selected on the command line"""
     try:
-        bus = can.interface.Bus(
-            channel='can0',
-            interface='socketcan',
-            bitrate=500000
-        )
-        print(f"✓ Connected to CAN bus on can0 at 500 kbps")
-        return bus
+        if args.transport == 'serial':
+            transport = SerialCanTransport(args.port)
+            print(f"✓ Connected to CAN adapter on {args.port}")
+        else:
+            transport = SocketCanTransport(args.channel)
+            print(f"✓ Connected to CAN bus on {args.channel} at 500 kbps")
+        return transport
     except Exception as e:
         print(f"✗ Failed to connect to CAN bus: {e}")
         print("\nTroubleshooting:")
-        print("1. Bring up CAN interface: sudo ip link set can0 up type can bitrate 500000")
-        print("2. Check interface: ip link show can0")
-        print("3. Install python-can: pip install python-can")
+        if args.transport == 'serial':
+            print(f"1. Check the adapter is plugged in: ls {args.port}")
+            print("2. Check you can open it: sudo usermod -aG dialout $USER")
+            print("3. Install pyserial: pip install pyserial")
+        else:
+            print(f"1. Bring up CAN interface: sudo ip link set {args.channel} up type can bitrate 500000")
+            print(f"2. Check interface: ip link show {args.channel}")
+            print("3. Install python-can: pip install python-can")
         sys.exit(1)
 
-def receive_can(bus):
-    """Receive and process CAN messages"""
+def receive_can(transport):
+    """Receive and process queued CAN frames
+
+    Returns True if it stopped at RX_BATCH_MAX with frames possibly left.
+    """
     global last_rx_heartbeat
     
-    # Non-blocking receive with timeout
-    message = bus.recv(timeout=0.01)
-    
-    if message:
-        can_id = message.arbitration_id
-        data = message.data
-        data_hex = ' '.join([f'{b:02x}' for b in data])
-        print(f"RX: ID=0x{can_id:03X} Data=[{data_hex}]")
+    # Called once select() reports the transport readable; drain what is
+    # queued so a burst costs one wakeup rather than one per frame
+    for _ in range(RX_BATCH_MAX):
+        frame = transport.recv(timeout=0)
+        if frame is None:
+            return False
         
-        if can_id == CANID_TX_HEARTBEAT:
-            last_rx_heartbeat = time.time()
-
-def send_can_frame(bus, can_id, data):
-    """Send a CAN frame"""
-    message = can.Message(
-        arbitration_id=can_id,
-        data=data,
-        is_extended_id=False
-    )
-    
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("RX: ID=0x%03X Data=[%s]", frame.can_id, frame.data.hex(' '))
+        
+        if frame.can_id == CANID_TX_HEARTBEAT:
+            last_rx_heartbeat = time.monotonic()
+    return True
+
+def send_can_frame(transport, can_id, data):
+    """Send a CAN frame; returns True on success"""
     try:
-        bus.send(message)
-        data_hex = ' '.join([f'{b:02x}' for b in data])
-        print(f"TX: ID=0x{can_id:03X} Data=[{data_hex}]")
+        transport.send(can_id, data)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("TX: ID=0x%03X Data=[%s]", can_id, bytes(data).hex(' '))
+        return True
     except Exception as e:
         print(f"✗ Error sending message: {e}")
+        return False
 
-def get_key():
-    """Get keyboard input (non-blocking)"""
-    if select.select([sys.stdin], [], [], 0)[0]:
-        return sys.stdin.read(1).encode()
-    return None
+def send_motor_command(transport, command, speed):
+    """Send a motor command, dropping repeats inside the debounce window
+
+    Stop is never debounced, and a failed send doesn't count as a repeat.
+    """
+    global last_command, last_command_time
+    
+    now = time.monotonic()
+    if (command != CMD_STOP and (command, speed) == last_command
+            and now - last_command_time < DEBOUNCE_INTERVAL):
+        return
+    
+    if send_can_frame(transport, CANID_MOTOR_CMD, MOTOR_CMD_FORMAT.pack(command, speed)):
+        last_command = (command, speed)
+        last_command_time = now
+
+def set_speed(level):
+    """Set the speed used by movement keys from a 1-9 level"""
+    global current_speed
+    current_speed = level * 11  # Map 1-9 to 11-99 PWM
+    print(f"Speed set to: {current_speed}%")
+
+# Key -> action(transport); current_speed is read when the key is pressed
+KEY_ACTIONS = {
+    key: lambda transport, command=command: send_motor_command(transport, command, current_speed)
+    for key, command in KEYMAP.items()
+}
+KEY_ACTIONS[' '] = lambda transport: send_motor_command(transport, CMD_STOP, 0x00)
+KEY_ACTIONS.update({
+    key: lambda transport, level=int(key): set_speed(level)
+    for key in SPEED_KEYS
+})
+
+def on_key(transport, key):
+    """Handle a single keypress"""
+    action = KEY_ACTIONS.get(key)
+    if action:
+        action(transport)
 
 def main():
-    global current_speed, last_tx_heartbeat, last_rx_heartbeat
+    global last_rx_heartbeat
+    
+    parser = argparse.ArgumentParser(description="Mini car keyboard controller")
+    parser.add_argument('--transport', choices=['socketcan', 'serial'], default='socketcan',
+                        help="how to reach the CAN bus (default: socketcan)")
+    parser.add_argument('--channel', default='can0', help="SocketCAN interface (default: can0)")
+    parser.add_argument('--port', default='/dev/ttyUSB0',
+                        help="serial port of the USB-CAN adapter (default: /dev/ttyUSB0)")
+    parser.add_argument('-v', '--verbose', action='store_true', help="log every CAN frame")
+    args = parser.parse_args()
+    logging.basicConfig(format='%(message)s')
+    log.setLevel(logging.DEBUG if args.verbose else logging.WARNING)
     
     # Initialize CAN bus
-    bus = setup_can_bus()
+    transport = setup_transport(args)
     
     print("\nControls: WASD=movement, SPACE=stop, 1-9=speed (1=11%, 9=99%)")
     print("Press Ctrl+C to exit\n")
     
-    # Set up terminal for non-blocking input
-    old_settings = termios.tcgetattr(sys.stdin)
-    tty.setcbreak(sys.stdin.fileno())
+    # Let the transport repeat the heartbeat itself where it can
+    heartbeat_task = transport.send_periodic(CANID_RX_HEARTBEAT, HEARTBEAT_DATA, HEARTBEAT_INTERVAL)
+    next_tx_heartbeat = time.monotonic()
+    rx_backlog = False
     
     try:
-        while True:
-            # log all RX 
-            if ser.in_waiting >= 20:
-                receive_can(ser)
+        with TerminalKeys() as keys, selectors.DefaultSelector() as selector:
+            # Register once; epoll then only reports fds that are ready
+            selector.register(keys, selectors.EVENT_READ)
+            selector.register(transport, selectors.EVENT_READ)
             
-            global last_tx_heartbeat
-
-            # send heartbeat to 
-            if time.time() - last_tx_heartbeat > 1:
-                send_can_frame(ser, CANID_RX_HEARTBEAT, [0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
-                last_tx_heartbeat = time.time()
-            # TX
-            if msvcrt.kbhit():
-                key = msvcrt.getch()
+            while True:
+                # Sleep until a key, a CAN frame or the next heartbeat is due
+                timeout = 0.0 if rx_backlog else max(0.0, next_tx_heartbeat - time.monotonic())
+                readable = {key.fileobj for key, _ in selector.select(timeout)}
                 
-                # Speed control (1-9)
-                if key in [b'1', b'2', b'3', b'4', b'5', b'6', b'7', b'8', b'9']:
-                    speed_level = int(key.decode())
-                    current_speed = int(speed_level * 11)  # Map 1-9 to 11-99 PWM
-                    print(f"Speed set to: {current_speed}%")
+                # log all RX
+                if rx_backlog or transport in readable:
+                    rx_backlog = receive_can(transport)
                 
-                # Movement commands
-                elif key == b'w':   # forward
-                    send_can_frame(bus, CANID_MOTOR_CMD, [CMD_FORWARD, current_speed, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
-                elif key == b'a':   # left
-                    send_can_frame(bus, CANID_MOTOR_CMD, [CMD_TURN_LEFT, current_speed, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
-                elif key == b's':   # backward
-                    send_can_frame(bus, CANID_MOTOR_CMD, [CMD_BACKWARD, current_speed, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
-                elif key == b'd':   # right
-                    send_can_frame(bus, CANID_MOTOR_CMD, [CMD_TURN_RIGHT, current_speed, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
-                elif key == b' ':   # stop
-                    send_can_frame(bus, CANID_MOTOR_CMD, [CMD_STOP, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
-            
-            # Check heartbeat timeout
-            if last_rx_heartbeat > 0 and time.time() - last_rx_heartbeat > 5:
-                print("⚠ Heartbeat timeout")
-                last_rx_heartbeat = 0  # Reset to avoid spam
-            
-            time.sleep(0.01)
+                # TX
+                if keys in readable:
+                    for key in keys.read():
+                        on_key(transport, key)
+                
+                now = time.monotonic()
+                
+                # send heartbeat to car (unless the transport already does it for us)
+                if now >= next_tx_heartbeat:
+                    if heartbeat_task is None:
+                        send_can_frame(transport, CANID_RX_HEARTBEAT, HEARTBEAT_DATA)
+                    next_tx_heartbeat = max(next_tx_heartbeat + HEARTBEAT_INTERVAL, now)
+                
+                # Check heartbeat timeout
+                if last_rx_heartbeat > 0 and now - last_rx_heartbeat > HEARTBEAT_TIMEOUT:
+                    print("⚠ Heartbeat timeout")
+                    last_rx_heartbeat = 0  # Reset to avoid spam
             
     except KeyboardInterrupt:
         print("\n\nStopped")
     finally:
-        # Restore terminal settings
-        termios.tcsetattr(sys.stdin, termios.TCSADRAIN, old_settings)
-        bus.shutdown()
+        transport.close()
         print("CAN bus closed.")
 
 if __name__ == "__main__":
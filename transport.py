@@ -0,0 +1,183 @@
+"""CAN transports for the mini car controllers
+
+Every transport exposes the same small interface, so the controller
+loop doesn't care whether frames go through SocketCAN or a Waveshare
+USB-CAN adapter on a serial port.
+"""
+from collections import deque
+from typing import NamedTuple, Optional, Protocol
+import functools
+import select
+import struct
+
+try:
+    import can
+except ImportError:
+    can = None
+
+try:
+    import serial
+except ImportError:
+    serial = None
+
+
+class Frame(NamedTuple):
+    can_id: int
+    data: bytes
+
+
+class Transport(Protocol):
+    def send(self, can_id: int, data: bytes) -> None: ...
+    def recv(self, timeout: float) -> Optional[Frame]: ...
+    def send_periodic(self, can_id: int, data: bytes, period: float): ...
+    def fileno(self) -> int: ...
+    def close(self) -> None: ...
+
+
+@functools.lru_cache(maxsize=512)
+def _message(can_id, data):
+    """Return the python-can message for a frame, built once per (id, data)"""
+    return can.Message(
+        arbitration_id=can_id,
+        data=data,
+        is_extended_id=False
+    )
+
+
+class SocketCanTransport:
+    """CAN through a Linux SocketCAN interface"""
+
+    def __init__(self, channel='can0', bitrate=500000):
+        if can is None:
+            raise RuntimeError("python-can is not installed (pip install python-can)")
+        self.bus = can.interface.Bus(
+            channel=channel,
+            interface='socketcan',
+            bitrate=bitrate
+        )
+
+    def send(self, can_id, data):
+        self.bus.send(_message(can_id, bytes(data)))
+
+    def recv(self, timeout):
+        message = self.bus.recv(timeout=timeout)
+        if message is None:
+            return None
+        return Frame(message.arbitration_id, message.data)
+
+    def send_periodic(self, can_id, data, period):
+        """Repeat a frame from the bus itself; None if unsupported"""
+        if not hasattr(self.bus, 'send_periodic'):
+            return None
+        # SocketCAN runs this in the kernel broadcast manager, so the
+        # frame keeps going without waking this process
+        return self.bus.send_periodic(_message(can_id, bytes(data)), period)
+
+    def fileno(self):
+        return self.bus.fileno()
+
+    def close(self):
+        self.bus.shutdown()
+
+
+# Waveshare USB-CAN framing: every frame is 20 bytes
+#   [0:2]  0xAA 0x55 header      [3] ID high byte   [5] ID low byte
+#   [9]    DLC                   [10:18] data       [19] checksum
+# and the remaining bytes hold the fixed values in FRAME_TEMPLATE.
+FRAME_SIZE = 20
+FRAME_HEADER = b'\xAA\x55'
+FRAME_TEMPLATE = b'\xAA\x55\x01\x00\x01\x00\x01\x00\x00\x00' + b'\x00' * 10
+FRAME_FIELDS = struct.Struct('>xxxBxBxxxB')  # id_h, id_l, dlc
+
+# Checksum is (sum of bytes 0-18 + 1) & 0xFF; the template's share is
+# constant, so only the ID, DLC and data need adding per frame
+_TEMPLATE_SUM = sum(FRAME_TEMPLATE[:19]) + 1
+
+
+def pack_frame(can_id, data):
+    """Build a Waveshare serial frame"""
+    dlc = len(data)
+    if dlc > 8:
+        raise ValueError("CAN frames carry at most 8 data bytes")
+    id_h = (can_id >> 8) & 0xFF
+    id_l = can_id & 0xFF
+
+    frame = bytearray(FRAME_TEMPLATE)
+    frame[3] = id_h
+    frame[5] = id_l
+    frame[9] = dlc
+    frame[10:10 + dlc] = data
+    frame[19] = (_TEMPLATE_SUM + id_h + id_l + dlc + sum(data)) & 0xFF
+    return frame
+
+
+# Use the compiled packer from _frame.pyx when it has been built
+try:
+    from _frame import pack_frame
+except ImportError:
+    pass
+
+
+def unpack_frame(buf, offset=0):
+    """Parse the Waveshare serial frame starting at buf[offset]"""
+    id_h, id_l, dlc = FRAME_FIELDS.unpack_from(buf, offset)
+    dlc = min(dlc, 8)
+    start = offset + 10
+    return Frame((id_h << 8) | id_l, bytes(buf[start:start + dlc]))
+
+
+class SerialCanTransport:
+    """CAN through a Waveshare USB-CAN adapter on a serial port
+
+    The adapter is expected to already be configured for the car's CAN
+    bitrate.
+    """
+
+    def __init__(self, port, baudrate=2000000):
+        if serial is None:
+            raise RuntimeError("pyserial is not installed (pip install pyserial)")
+        self.ser = serial.Serial(port, baudrate, timeout=0)
+        self._rx = bytearray()  # bytes read but not yet parsed
+        self._frames = deque()  # parsed frames not yet returned
+
+    def send(self, can_id, data):
+        # bytes() so the compiled and pure-Python packers take the same input
+        self.ser.write(pack_frame(can_id, bytes(data)))
+
+    def recv(self, timeout):
+        if not self._frames:
+            if not self.ser.in_waiting:
+                select.select([self.ser], [], [], timeout)
+            # Take everything the driver has buffered in one read and
+            # parse every complete frame out of it
+            self._rx += self.ser.read(self.ser.in_waiting)
+            self._parse()
+        return self._frames.popleft() if self._frames else None
+
+    def _parse(self):
+        rx = self._rx
+        offset = 0
+        while len(rx) - offset >= FRAME_SIZE:
+            if rx[offset:offset + 2] != FRAME_HEADER:
+                # Lost framing; skip ahead to the next header
+                start = rx.find(FRAME_HEADER, offset + 1)
+                offset = start if start != -1 else len(rx) - 1
+                continue
+            if (sum(rx[offset:offset + 19]) + 1) & 0xFF != rx[offset + 19]:
+                # Header bytes inside a payload, or a dropped byte; resync
+                start = rx.find(FRAME_HEADER, offset + 1)
+                offset = start if start != -1 else len(rx) - 1
+                continue
+            self._frames.append(unpack_frame(rx, offset))
+            offset += FRAME_SIZE
+        del rx[:offset]
+
+    def send_periodic(self, can_id, data, period):
+        """The adapter has no periodic send; the caller must repeat the frame"""
+        return None
+
+    def fileno(self):
+        return self.ser.fileno()
+
+    def close(self):
+        self.ser.close()
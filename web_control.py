@@ -1,11 +1,24 @@
-from flask import Flask, render_template, jsonify, request
-from flask_cors import CORS
+from aiohttp import WSMsgType, web
+from pathlib import Path
+from types import MappingProxyType
+import argparse
+import asyncio
 import can
+import functools
+import json
+import logging
 import time
-import threading
 
-app = Flask(__name__)
-CORS(app)
+# uvloop is a faster drop-in event loop; stock asyncio works without it
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    pass
+
+log = logging.getLogger('web_control')
+routes = web.RouteTableDef()
+TEMPLATE_DIR = Path(__file__).parent / 'templates'
 
 # CAN IDs
 CANID_MOTOR_CMD = 0x100
@@ -19,16 +32,31 @@ CMD_BACKWARD = 4
 CMD_TURN_LEFT = 1
 CMD_TURN_RIGHT = 2
 
+HEARTBEAT_DATA = bytes(8)  # heartbeat payload is all zeros
+
+HEARTBEAT_INTERVAL = 1.0  # seconds between TX heartbeats
+HEARTBEAT_TIMEOUT = 5.0   # seconds without RX heartbeat before flagging it lost
+
 # Global state
 bus = None
-last_rx_heartbeat = 0
-last_tx_heartbeat = 0
-telemetry_data = {
+notifier = None
+heartbeat = None
+heartbeat_cyclic = None  # bus-driven periodic heartbeat, when supported
+status_snapshot = None  # telemetry snapshot that status_prefix was built from
+status_prefix = b''     # its JSON encoding, minus the closing brace
+last_rx_heartbeat = 0  # time.monotonic() of last RX heartbeat, 0 = none yet
+# Read-only snapshot; writers publish a new one via update_telemetry()
+telemetry_data = MappingProxyType({
     'connected': False,
     'last_command': 'STOP',
     'heartbeat_ok': False,
-    'messages_received': 0
-}
+    'heartbeats_received': 0
+})
+
+def update_telemetry(**changes):
+    """Swap in a new telemetry snapshot so readers never see a partial update"""
+    global telemetry_data
+    telemetry_data = MappingProxyType({**telemetry_data, **changes})
 
 def setup_can_bus():
     """Initialize CAN bus connection"""
@@ -36,75 +64,132 @@ def setup_can_bus():
         bus = can.interface.Bus(
             channel='can0',
             interface='socketcan',
-            bitrate=500000
+            bitrate=500000,
+            # Only the car's heartbeat is used here; let the kernel drop
+            # everything else before it reaches this process
+            can_filters=[{'can_id': CANID_TX_HEARTBEAT, 'can_mask': 0x7FF, 'extended': False}]
         )
         print(f"✓ Connected to CAN bus on can0 at 500 kbps")
-        telemetry_data['connected'] = True
+        update_telemetry(connected=True)
         return bus
     except Exception as e:
         print(f"✗ Failed to connect to CAN bus: {e}")
-        telemetry_data['connected'] = False
+        update_telemetry(connected=False)
         return None
 
 def send_can_frame(can_id, data):
     """Send a CAN frame"""
-    if bus is None:
-        return False
-    
     message = can.Message(
         arbitration_id=can_id,
         data=data,
         is_extended_id=False
     )
+    return send_message(message)
+
+def send_message(message):
+    """Send a prebuilt CAN message"""
+    if bus is None:
+        return False
     
     try:
         bus.send(message)
-        data_hex = ' '.join([f'{b:02x}' for b in data])
-        print(f"TX: ID=0x{can_id:03X} Data=[{data_hex}]")
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("TX: ID=0x%03X Data=[%s]", message.arbitration_id, message.data.hex(' '))
         return True
     except Exception as e:
         print(f"✗ Error sending message: {e}")
         return False
 
-def heartbeat_thread():
-    """Background thread to send heartbeat and receive messages"""
-    global last_tx_heartbeat, last_rx_heartbeat
+@functools.lru_cache(maxsize=512)
+def motor_message(cmd_value, speed_value):
+    """Return the motor command message, built once per (command, speed)"""
+    return can.Message(
+        arbitration_id=CANID_MOTOR_CMD,
+        data=bytes((cmd_value, speed_value, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00)),
+        is_extended_id=False
+    )
+
+def on_can_message(message):
+    """Handle a received CAN frame; called by the event loop when the socket is readable"""
+    global last_rx_heartbeat
+    
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("RX: ID=0x%03X Data=[%s]", message.arbitration_id, message.data.hex(' '))
+    
+    # The bus filter only lets the car's heartbeat through
+    last_rx_heartbeat = time.monotonic()
+    update_telemetry(heartbeats_received=telemetry_data['heartbeats_received'] + 1,
+                     heartbeat_ok=True)
+
+async def heartbeat_task():
+    """Send heartbeat every second (if the bus can't) and track heartbeat timeout"""
+    next_tx_heartbeat = time.monotonic()
     
     while True:
-        # Send heartbeat every 1 second
-        if time.time() - last_tx_heartbeat > 1:
-            send_can_frame(CANID_RX_HEARTBEAT, [0x00] * 8)
-            last_tx_heartbeat = time.time()
-        
-        # Receive CAN messages
-        if bus:
-            message = bus.recv(timeout=0.01)
-            if message:
-                can_id = message.arbitration_id
-                data = message.data
-                data_hex = ' '.join([f'{b:02x}' for b in data])
-                print(f"RX: ID=0x{can_id:03X} Data=[{data_hex}]")
-                
-                telemetry_data['messages_received'] += 1
-                
-                if can_id == CANID_TX_HEARTBEAT:
-                    last_rx_heartbeat = time.time()
-                    telemetry_data['heartbeat_ok'] = True
+        if heartbeat_cyclic is None:
+            send_can_frame(CANID_RX_HEARTBEAT, HEARTBEAT_DATA)
         
         # Check heartbeat timeout
-        if last_rx_heartbeat > 0 and time.time() - last_rx_heartbeat > 5:
-            telemetry_data['heartbeat_ok'] = False
+        now = time.monotonic()
+        if (last_rx_heartbeat > 0 and now - last_rx_heartbeat > HEARTBEAT_TIMEOUT
+                and telemetry_data['heartbeat_ok']):
+            update_telemetry(heartbeat_ok=False)
         
-        time.sleep(0.01)
+        # Sleep to a fixed deadline so send time doesn't accumulate as drift
+        next_tx_heartbeat = max(next_tx_heartbeat + HEARTBEAT_INTERVAL, now)
+        await asyncio.sleep(next_tx_heartbeat - now)
 
-@app.route('/')
-def index():
-    return render_template('control.html')
+async def start_background_tasks(app):
+    """Start the heartbeat task and hook CAN RX into the event loop"""
+    global notifier, heartbeat, heartbeat_cyclic
+    
+    if bus is not None and hasattr(bus, 'send_periodic'):
+        # SocketCAN runs this in the kernel broadcast manager
+        message = can.Message(
+            arbitration_id=CANID_RX_HEARTBEAT,
+            data=HEARTBEAT_DATA,
+            is_extended_id=False
+        )
+        heartbeat_cyclic = bus.send_periodic(message, HEARTBEAT_INTERVAL)
+    
+    heartbeat = asyncio.create_task(heartbeat_task())
+    if bus:
+        # SocketCAN exposes a file descriptor, so the notifier uses
+        # loop.add_reader() and frames are delivered without polling
+        notifier = can.Notifier(bus, [on_can_message], loop=asyncio.get_running_loop())
 
-@app.route('/command', methods=['POST'])
-def send_command():
-    """Handle motor command from web interface"""
-    data = request.json
+async def stop_background_tasks(app):
+    """Stop background work and release the CAN bus"""
+    heartbeat.cancel()
+    if heartbeat_cyclic:
+        heartbeat_cyclic.stop()
+    if notifier:
+        notifier.stop()
+    if bus:
+        bus.shutdown()
+
+@web.middleware
+async def cors_middleware(request, handler):
+    """Allow the control page to be served from another origin"""
+    if request.method == 'OPTIONS':
+        response = web.Response()
+        response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    else:
+        response = await handler(request)
+    if not response.prepared:  # WebSocket responses have already sent headers
+        response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+@routes.get('/')
+async def index(request):
+    return web.FileResponse(TEMPLATE_DIR / 'control.html')
+
+def run_command(data):
+    """Send a motor command; returns (response body, HTTP status)"""
+    if not isinstance(data, dict):
+        return {'status': 'error', 'message': 'Invalid command'}, 400
+    
     command = data.get('command')
     speed = data.get('speed', 50)
     
@@ -117,38 +202,106 @@ def send_command():
         'stop': CMD_STOP
     }
     
-    if command not in cmd_map:
-        return jsonify({'status': 'error', 'message': 'Invalid command'}), 400
+    if not isinstance(command, str) or command not in cmd_map:
+        return {'status': 'error', 'message': 'Invalid command'}, 400
     
     cmd_value = cmd_map[command]
-    speed_value = 0 if command == 'stop' else int(speed)
+    if command == 'stop':
+        speed_value = 0
+    else:
+        # Only whole JSON numbers; bool is an int subclass, and inf/nan
+        # aren't integral
+        if isinstance(speed, bool):
+            speed_value = None
+        elif isinstance(speed, int):
+            speed_value = speed
+        elif isinstance(speed, float) and speed.is_integer():
+            speed_value = int(speed)
+        else:
+            speed_value = None
+        if speed_value is None or not 0 <= speed_value <= 99:
+            return {'status': 'error', 'message': 'Invalid speed (expected 0-99)'}, 400
     
     # Send CAN message
-    can_data = [cmd_value, speed_value, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
-    success = send_can_frame(CANID_MOTOR_CMD, can_data)
+    success = send_message(motor_message(cmd_value, speed_value))
     
     if success:
-        telemetry_data['last_command'] = command.upper()
-        return jsonify({
+        update_telemetry(last_command=command.upper())
+        return {
             'status': 'success',
             'command': command,
             'speed': speed_value
-        })
+        }, 200
     else:
-        return jsonify({'status': 'error', 'message': 'CAN send failed'}), 500
+        return {'status': 'error', 'message': 'CAN send failed'}, 500
+
+def handle_command(text):
+    """Parse and run one JSON command (str or bytes); returns (response body, HTTP status)
 
-@app.route('/status', methods=['GET'])
-def get_status():
+    Never raises, so a bad request can't crash a handler or close /ws.
+    """
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return {'status': 'error', 'message': 'Invalid JSON'}, 400
+    
+    try:
+        return run_command(data)
+    except Exception:
+        log.exception("Error handling command %r", data)
+        return {'status': 'error', 'message': 'Internal error'}, 500
+
+@routes.post('/command')
+async def send_command(request):
+    """Handle motor command from web interface"""
+    body, status = handle_command(await request.read())
+    return web.json_response(body, status=status)
+
+@routes.get('/ws')
+async def command_socket(request):
+    """Handle motor commands over one long-lived WebSocket
+
+    Each text frame carries the same JSON as a POST to /command and gets
+    the same JSON reply, without a new HTTP request per keypress.
+    """
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+    
+    async for msg in ws:
+        if msg.type != WSMsgType.TEXT:
+            continue
+        body, _ = handle_command(msg.data)
+        await ws.send_json(body)
+    
+    return ws
+
+@routes.get('/status')
+async def get_status(request):
     """Return current system status"""
-    return jsonify({
-        'connected': telemetry_data['connected'],
-        'last_command': telemetry_data['last_command'],
-        'heartbeat_ok': telemetry_data['heartbeat_ok'],
-        'messages_received': telemetry_data['messages_received'],
-        'timestamp': time.time()
-    })
+    global status_snapshot, status_prefix
+    
+    # Snapshots are replaced, never mutated, so the encoded JSON only
+    # needs rebuilding when a new one has been published
+    snapshot = telemetry_data
+    if snapshot is not status_snapshot:
+        status_prefix = json.dumps(dict(snapshot))[:-1].encode()
+        status_snapshot = snapshot
+    
+    body = status_prefix + b', "timestamp": ' + repr(time.time()).encode() + b'}'
+    return web.Response(body=body, content_type='application/json')
+
+app = web.Application(middlewares=[cors_middleware])
+app.add_routes(routes)
+app.on_startup.append(start_background_tasks)
+app.on_cleanup.append(stop_background_tasks)
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Mini car web control server")
+    parser.add_argument('-v', '--verbose', action='store_true', help="log every CAN frame")
+    args = parser.parse_args()
+    logging.basicConfig(format='%(message)s')
+    log.setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+    
     # Initialize CAN bus
     bus = setup_can_bus()
     
@@ -156,12 +309,8 @@ if __name__ == '__main__':
         print("\n⚠ Warning: CAN bus not available. Running in demo mode.")
         print("Commands will be logged but not sent.\n")
     
-    # Start heartbeat thread
-    thread = threading.Thread(target=heartbeat_thread, daemon=True)
-    thread.start()
-    
     print("\n" + "="*50)
     print("🚗 Mini Car Web Control Server Starting")
     print("="*50)
     
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    web.run_app(app, host='0.0.0.0', port=5000)